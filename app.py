@@ -1,66 +1,341 @@
 # app.py
-from flask import Flask, request, render_template
+from flask import Flask, request, render_template, jsonify, abort
 import pandas as pd
 import joblib
 import numpy as np
+import threading
+import queue
+import time
+import os
+import hashlib
+import json
+import math
+from functools import lru_cache
+import lightgbm as lgb
+from sklearn.linear_model import LogisticRegression
+from sklearn.ensemble import RandomForestClassifier
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+try:
+    from numba import njit
+except ImportError:
+    # Without numba the row scorer below runs as plain Python
+    def njit(*args, **kwargs):
+        return lambda fn: fn
 
 # Initialize the Flask app
 app = Flask(__name__)
 
 # Load the trained model and the scaler
-model = joblib.load('models/model.pkl')
+MODEL_PATH = 'models/model.pkl'
+ONNX_MODEL_PATH = 'models/model.onnx'
+model = joblib.load(MODEL_PATH)
 scaler = joblib.load('processors/scaler.joblib')
 
-# Define the home page route
-@app.route('/')
-def home():
-    return render_template('index.html')
+# Cache the scaler's affine parameters so features can be scaled in place
+scaler_mean = scaler.mean_.astype(np.float32)
+scaler_inv_scale = (1.0 / scaler.scale_).astype(np.float32)
 
-# Define the prediction route
-@app.route('/predict', methods=['POST'])
-def predict():
-    # Get the input values from the form
-    input_features = [float(x) for x in request.form.values()]
+def is_binary_logistic(model):
+    """Returns True for a LogisticRegression with a single decision function."""
+    return isinstance(model, LogisticRegression) and model.coef_.shape[0] == 1
 
-    # The order of features must match the order the model was trained on.
-    # This order is from our X_train.csv file.
-    feature_names = ['credit_lines_outstanding', 'loan_amt_outstanding', 
-                     'total_debt_outstanding', 'income', 'years_employed', 'fico_score',
-                     'debt_to_income_ratio', 'loan_to_income_ratio']
+def fold_scaler_into_weights(model):
+    """Returns float32 (W, B) such that W.x + B equals the model's decision on scaled x.
 
-    # We need to re-create the engineered features from the raw inputs
-    # Note: The form gives us inputs in a different order. We need to map them correctly.
-    form_values = request.form
+    w.((x - mean) * inv_scale) + b == (w * inv_scale).x + (b - (w * inv_scale).mean),
+    so features can be scored without a separate scaling pass.
+    """
+    weights = model.coef_[0] * (1.0 / scaler.scale_)
+    W = weights.astype(np.float32)
+    B = np.float32(model.intercept_[0] - np.dot(weights, scaler.mean_))
+    return W, B
+
+@njit(cache=True, fastmath=True)
+def logistic_row_score(credit_lines, loan_amt, total_debt, income, years_employed, fico_score, W, B):
+    """Engineers, scales and scores one raw row with folded logistic weights.
+
+    Returns the index of the predicted class without allocating any arrays.
+    """
+    debt_to_income = total_debt / (income + 1e-6)
+    loan_to_income = loan_amt / (income + 1e-6)
+    score = (B + W[0] * credit_lines + W[1] * loan_amt + W[2] * total_debt + W[3] * income
+             + W[4] * years_employed + W[5] * fico_score + W[6] * debt_to_income
+             + W[7] * loan_to_income)
+    return 1 if score > 0 else 0
+
+def build_row_score_fn(model):
+    """Returns a scorer taking the six raw inputs of one applicant, or None.
+
+    Only logistic regression has one: a single row is cheaper to score inline
+    than to hand over to the micro-batcher, which pays off for tree models.
+    """
+    if not is_binary_logistic(model):
+        return None
+
+    W, B = fold_scaler_into_weights(model)
+    classes = model.classes_
+
+    # Compile (or load the cached compilation) now rather than on the first request
+    logistic_row_score(0.0, 0.0, 0.0, 1.0, 0.0, 0.0, W, B)
+
+    return lambda *row: classes[logistic_row_score(*row, W, B)]
+
+def build_score_fn(model):
+    """Returns a scorer specialised for the loaded model type.
+
+    The scorer takes an unscaled float32 array of shape (n, 8), which it may
+    modify in place, and returns the predicted class labels, skipping the
+    generic validation done by predict().
+    """
+    classes = model.classes_
+
+    if is_binary_logistic(model):
+        # The decision is a single float32 BLAS dot product on the raw features
+        W, B = fold_scaler_into_weights(model)
+        return lambda x: classes[(np.dot(x, W) + B > 0).astype(np.intp)]
+
+    score = build_scaled_score_fn(model, classes)
+    def scale_and_score(x):
+        np.subtract(x, scaler_mean, out=x)
+        np.multiply(x, scaler_inv_scale, out=x)
+        return score(x)
+    return scale_and_score
+
+def load_onnx_session():
+    """Returns an ONNX Runtime session for the exported model, or None if unavailable."""
+    if ort is None or not os.path.exists(ONNX_MODEL_PATH):
+        return None
+    # Score on the calling thread: the batches are small, and the session is created
+    # before gunicorn forks its workers, so it must not own a thread pool
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = 1
+    options.inter_op_num_threads = 1
+    session = ort.InferenceSession(ONNX_MODEL_PATH, sess_options=options,
+                                   providers=['CPUExecutionProvider'])
+
+    # Ignore an export that was converted from a different model.pkl
+    with open(MODEL_PATH, 'rb') as f:
+        model_digest = hashlib.sha256(f.read()).hexdigest()
+    if session.get_modelmeta().custom_metadata_map.get('source_sha256') != model_digest:
+        return None
+    return session
+
+def build_scaled_score_fn(model, classes):
+    """Returns a scorer for models that need the features scaled first."""
+    # Prefer the compiled ONNX tree runtime over the Python-level predict loops
+    session = load_onnx_session()
+    if session is not None:
+        input_name = session.get_inputs()[0].name
+        label_name = session.get_outputs()[0].name
+        return lambda x: session.run([label_name], {input_name: x})[0]
+    if isinstance(model, RandomForestClassifier) and model.n_outputs_ == 1:
+        # Average the tree probabilities directly instead of going through the
+        # forest's thread pool, which dominates the cost for a single row
+        trees = model.estimators_
+        n_trees = len(trees)
+        def score(x):
+            proba = trees[0].predict_proba(x, check_input=False)
+            for tree in trees[1:]:
+                proba += tree.predict_proba(x, check_input=False)
+            return classes[np.argmax(proba / n_trees, axis=1)]
+        return score
+
+    if isinstance(model, lgb.LGBMClassifier) and len(classes) == 2:
+        # Binary objective: the booster returns the positive class probability
+        booster = model.booster_
+        return lambda x: classes[(booster.predict(x) > 0.5).astype(np.intp)]
+
+    return model.predict
+
+app.config['score_fn'] = build_score_fn(model)
+app.config['row_score_fn'] = build_row_score_fn(model)
+
+# Raw form fields, in the order the model was trained on
+RAW_FEATURE_NAMES = ['credit_lines_outstanding', 'loan_amt_outstanding',
+                     'total_debt_outstanding', 'income', 'years_employed', 'fico_score']
 
-    # Extract basic features in the correct order
-    # This is a bit manual and depends on your HTML form's 'name' attributes
-    # A more robust app might handle this mapping more elegantly.
-    credit_lines = float(form_values['credit_lines_outstanding'])
-    loan_amt = float(form_values['loan_amt_outstanding'])
-    total_debt = float(form_values['total_debt_outstanding'])
-    income = float(form_values['income'])
-    years_employed = float(form_values['years_employed'])
-    fico_score = float(form_values['fico_score'])
+# Micro-batching settings for the single-row /predict route
+BATCH_SIZE = 64
+BATCH_TIMEOUT = 0.003  # seconds to wait for more requests to join a batch
+
+# Largest number of instances accepted by /predict_batch in one request
+MAX_BATCH_INSTANCES = 10000
+
+class MicroBatcher:
+    """Coalesces concurrent single-row requests into one vectorised score call."""
+
+    def __init__(self, batch_size=BATCH_SIZE, timeout=BATCH_TIMEOUT):
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        # Rows submitted but not yet scored, so the worker knows when nobody else is waiting
+        self._in_flight = 0
+
+    def _ensure_worker(self):
+        # Started lazily so every forked server process gets its own worker thread
+        if self._worker is None or not self._worker.is_alive():
+            with self._lock:
+                if self._worker is None or not self._worker.is_alive():
+                    self._worker = threading.Thread(target=self._run, daemon=True)
+                    self._worker.start()
+
+    def submit(self, row):
+        """Queues one raw feature row and blocks until its prediction is ready."""
+        self._ensure_worker()
+        # Slot layout: [row, done event, prediction, error]
+        slot = [row, threading.Event(), None, None]
+        with self._lock:
+            self._in_flight += 1
+        self._queue.put(slot)
+        slot[1].wait()
+        if slot[3] is not None:
+            raise slot[3]
+        return slot[2]
+
+    def _run(self):
+        # The worker owns this buffer, so no locking is needed around it
+        buffer = np.empty((self.batch_size, 8), dtype=np.float32)
+        while True:
+            pending = [self._queue.get()]
+            deadline = time.monotonic() + self.timeout
+            while len(pending) < self.batch_size:
+                # Only wait for rows that have been submitted; a lone request is scored at once
+                if len(pending) >= self._in_flight:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    pending.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            batch = buffer[:len(pending)]
+            for i, slot in enumerate(pending):
+                batch[i] = slot[0]
+
+            try:
+                predictions = app.config['score_fn'](batch)
+                for slot, prediction in zip(pending, predictions):
+                    slot[2] = prediction
+            except Exception as e:
+                for slot in pending:
+                    slot[3] = e
+
+            with self._lock:
+                self._in_flight -= len(pending)
+            for slot in pending:
+                slot[1].set()
+
+batcher = MicroBatcher()
+
+# Prediction cache settings: inputs are keyed at a resolution of 1 / FEATURE_QUANTUM
+PREDICTION_CACHE_SIZE = 8192
+FEATURE_QUANTUM = 1000
+
+def quantize_features(*values):
+    """Returns the integer cache key for a set of raw feature values."""
+    return tuple(round(value * FEATURE_QUANTUM) for value in values)
+
+@lru_cache(maxsize=PREDICTION_CACHE_SIZE)
+def cached_predict(credit_lines, loan_amt, total_debt, income, years_employed, fico_score):
+    """Predicts from quantized raw features, memoising repeated applicants."""
+    credit_lines, loan_amt, total_debt, income, years_employed, fico_score = (
+        value / FEATURE_QUANTUM
+        for value in (credit_lines, loan_amt, total_debt, income, years_employed, fico_score))
+
+    # Score inline when the model has a compiled single-row scorer
+    row_score_fn = app.config['row_score_fn']
+    if row_score_fn is not None:
+        return int(row_score_fn(credit_lines, loan_amt, total_debt, income,
+                                years_employed, fico_score))
 
     # Re-engineer the ratio features
     debt_to_income = total_debt / (income + 1e-6)
     loan_to_income = loan_amt / (income + 1e-6)
 
-    # Create the final feature array in the correct order for the model
-    final_features = np.array([credit_lines, loan_amt, total_debt, income, 
-                               years_employed, fico_score, debt_to_income, loan_to_income])
+    # Make the prediction, batched together with any concurrent requests
+    return int(batcher.submit((credit_lines, loan_amt, total_debt, income,
+                               years_employed, fico_score, debt_to_income, loan_to_income)))
 
-    # Reshape for a single prediction and scale the data
-    final_features_reshaped = final_features.reshape(1, -1)
-    scaled_features = scaler.transform(final_features_reshaped)
+# Define the home page route
+@app.route('/')
+def home():
+    return render_template('index.html')
+
+# Prebuilt JSON bodies for the two possible outcomes
+PREDICTION_TEXT = {0: "Will Not Default", 1: "Will Default"}
+PREDICTION_JSON = {label: json.dumps({'prediction': text, 'default': label == 1})
+                   for label, text in PREDICTION_TEXT.items()}
+
+def predict_from_form():
+    """Returns the 0/1 prediction for the applicant in the submitted form."""
+    # Extract the raw features in the order the model was trained on. Indexing the form
+    # directly keeps Werkzeug's 400 response for a missing field
+    form_values = request.form
+    credit_lines, loan_amt, total_debt, income, years_employed, fico_score = (
+        float(form_values[name]) for name in RAW_FEATURE_NAMES)
+
+    # Reject NaN, infinity and values too large to quantize, as /predict_batch does
+    if not all(math.isfinite(value * FEATURE_QUANTUM) for value in
+               (credit_lines, loan_amt, total_debt, income, years_employed, fico_score)):
+        abort(400, description="Feature values must be finite numbers")
 
-    # Make the prediction
-    prediction = model.predict(scaled_features)
+    # Make the prediction, reusing the cached result for a repeated applicant
+    return cached_predict(*quantize_features(credit_lines, loan_amt, total_debt, income,
+                                             years_employed, fico_score))
 
-    # Display the result
-    output = "Will Default" if prediction[0] == 1 else "Will Not Default"
+# Define the prediction route, used by the page's JavaScript
+@app.route('/predict', methods=['POST'])
+def predict():
+    return app.response_class(PREDICTION_JSON[predict_from_form()], mimetype='application/json')
 
+# Define the server-rendered prediction route, used when JavaScript is unavailable
+@app.route('/predict_html', methods=['POST'])
+def predict_html():
+    output = PREDICTION_TEXT[predict_from_form()]
     return render_template('index.html', prediction_text=f'Predicted Status: {output}')
 
+# Define the batch prediction route
+@app.route('/predict_batch', methods=['POST'])
+def predict_batch():
+    """Scores a JSON list of applicants in one vectorised call.
+
+    Accepts either a list of objects or {"instances": [...]}, where each object
+    has the same fields as the HTML form.
+    """
+    payload = request.get_json(silent=True)
+    instances = payload.get('instances') if isinstance(payload, dict) else payload
+    if not isinstance(instances, list) or not instances:
+        return jsonify(error="Expected a non-empty list of instances"), 400
+    if len(instances) > MAX_BATCH_INSTANCES:
+        return jsonify(error=f"At most {MAX_BATCH_INSTANCES} instances per request"), 400
+
+    try:
+        raw = np.array([[float(instance[name]) for name in RAW_FEATURE_NAMES]
+                        for instance in instances], dtype=np.float64)
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify(error=f"Invalid instance: {e}"), 400
+    # The JSON parser accepts NaN and Infinity, which the scorers would silently map to a class
+    if not np.isfinite(raw).all():
+        return jsonify(error="Feature values must be finite numbers"), 400
+
+    # Build the features, re-engineering the ratio features column-wise
+    features = np.empty((len(raw), 8), dtype=np.float32)
+    features[:, :6] = raw
+    features[:, 6] = raw[:, 2] / (raw[:, 3] + 1e-6)
+    features[:, 7] = raw[:, 1] / (raw[:, 3] + 1e-6)
+
+    predictions = app.config['score_fn'](features)
+    return jsonify(predictions=[int(p) for p in predictions])
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=4999, debug=True)
\ No newline at end of file
+    # Local development server only, production runs under gunicorn (see gunicorn_conf.py)
+    app.run(host='0.0.0.0', port=4999)
\ No newline at end of file
@@ -0,0 +1,15 @@
+# gunicorn_conf.py
+# Production server settings, used with: gunicorn -c gunicorn_conf.py wsgi:app
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '4999')}"
+
+# Load the app (model + scaler) once in the master, then fork the workers so the
+# loaded model is shared copy-on-write instead of being loaded per worker
+preload_app = True
+
+# Several processes with a few threads each so concurrent requests are handled in parallel
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = 4
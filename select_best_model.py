@@ -10,6 +10,8 @@ import mlflow.sklearn
 import pandas as pd
 from pathlib import Path
 import shutil
+import joblib
+import hashlib
 
 def analyze_mlflow_experiments():
     """Analyze all MLflow experiments and find the best model."""
@@ -20,7 +22,7 @@ def analyze_mlflow_experiments():
     # Get all experiments
     experiments = mlflow.search_experiments()
     
-    all_runs = []
+    best_run = None
     
     print("🔍 Analyzing MLflow experiments...")
     print("=" * 60)
@@ -28,64 +30,124 @@ def analyze_mlflow_experiments():
     for exp in experiments:
         print(f"\n📊 Experiment: {exp.name} (ID: {exp.experiment_id})")
         
-        # Get all runs for this experiment
-        runs = mlflow.search_runs(experiment_ids=[exp.experiment_id])
+        # Let the tracking backend sort the runs and return only the top one
+        top_runs = mlflow.search_runs(
+            experiment_ids=[exp.experiment_id],
+            order_by=["metrics.accuracy DESC"],
+            max_results=1
+        )
         
-        if runs.empty:
-            print("   No runs found in this experiment.")
+        top_run = None if top_runs.empty else top_runs.iloc[0]
+        if top_run is None or pd.isna(top_run.get('metrics.accuracy')):
+            print("   No runs with an accuracy metric found in this experiment.")
             continue
-            
-        print(f"   Found {len(runs)} runs")
         
-        # Add experiment info to runs
-        runs['experiment_name'] = exp.name
-        runs['experiment_id'] = exp.experiment_id
+        print(f"   Best accuracy: {top_run['metrics.accuracy']:.4f}")
         
-        all_runs.append(runs)
+        # Keep a running best across experiments
+        if best_run is None or top_run['metrics.accuracy'] > best_run['metrics.accuracy']:
+            best_run = top_run.copy()
+            best_run['experiment_name'] = exp.name
+            best_run['experiment_id'] = exp.experiment_id
     
-    if not all_runs:
-        print("❌ No experiments found!")
+    if best_run is None:
+        print("❌ No runs with an accuracy metric found!")
         return None
     
-    # Combine all runs
-    combined_runs = pd.concat(all_runs, ignore_index=True)
-    
-    print(f"\n📈 Total runs across all experiments: {len(combined_runs)}")
-    
     # Display summary of metrics
     print("\n📊 Available metrics:")
-    metric_cols = [col for col in combined_runs.columns if col.startswith('metrics.')]
-    for col in metric_cols:
+    for col in best_run.filter(regex=r'^metrics\.').index:
         print(f"   - {col}")
     
-    # Find the best run based on accuracy
-    if 'metrics.accuracy' in combined_runs.columns:
-        best_run = combined_runs.loc[combined_runs['metrics.accuracy'].idxmax()]
-        
-        print(f"\n🏆 Best Model Found:")
-        print(f"   Run ID: {best_run['run_id']}")
-        print(f"   Experiment: {best_run['experiment_name']}")
-        print(f"   Accuracy: {best_run['metrics.accuracy']:.4f}")
-        
-        if 'metrics.precision' in combined_runs.columns:
-            print(f"   Precision: {best_run['metrics.precision']:.4f}")
-        if 'metrics.recall' in combined_runs.columns:
-            print(f"   Recall: {best_run['metrics.recall']:.4f}")
-        if 'metrics.f1_score' in combined_runs.columns:
-            print(f"   F1-Score: {best_run['metrics.f1_score']:.4f}")
-        
-        # Display parameters
-        param_cols = [col for col in combined_runs.columns if col.startswith('params.')]
-        if param_cols:
-            print(f"\n🔧 Model Parameters:")
-            for col in param_cols:
-                if pd.notna(best_run[col]):
-                    print(f"   {col}: {best_run[col]}")
+    print(f"\n🏆 Best Model Found:")
+    print(f"   Run ID: {best_run['run_id']}")
+    print(f"   Experiment: {best_run['experiment_name']}")
+    print(f"   Accuracy: {best_run['metrics.accuracy']:.4f}")
+    
+    if 'metrics.precision' in best_run.index:
+        print(f"   Precision: {best_run['metrics.precision']:.4f}")
+    if 'metrics.recall' in best_run.index:
+        print(f"   Recall: {best_run['metrics.recall']:.4f}")
+    if 'metrics.f1_score' in best_run.index:
+        print(f"   F1-Score: {best_run['metrics.f1_score']:.4f}")
+    
+    # Display parameters
+    params = best_run.filter(regex=r'^params\.').dropna()
+    if not params.empty:
+        print(f"\n🔧 Model Parameters:")
+        for col, value in params.items():
+            print(f"   {col}: {value}")
+    
+    return best_run
+
+def export_onnx_model(model_path, onnx_path='models/model.onnx'):
+    """Convert a tree-based model to ONNX so the Flask app can score it with ONNX Runtime."""
+    
+    # Never leave an export from a previously selected model behind
+    if os.path.exists(onnx_path):
+        os.remove(onnx_path)
+    
+    model = joblib.load(model_path)
+    model_type = type(model).__name__
+    
+    if model_type not in ('RandomForestClassifier', 'LGBMClassifier'):
+        print(f"⏭️  {model_type} is scored natively by the app, skipping ONNX export.")
+        return False
+    
+    try:
+        from skl2onnx.common.data_types import FloatTensorType
+        initial_types = [('x', FloatTensorType([None, 8]))]
         
-        return best_run
-    else:
-        print("❌ No accuracy metric found in experiments!")
+        if model_type == 'LGBMClassifier':
+            import onnxmltools
+            onnx_model = onnxmltools.convert_lightgbm(model, initial_types=initial_types, zipmap=False)
+        else:
+            from skl2onnx import convert_sklearn
+            onnx_model = convert_sklearn(model, initial_types=initial_types,
+                                         options={id(model): {'zipmap': False}})
+    except ImportError as e:
+        print(f"⚠️  ONNX converters not installed ({e}), the app will use model.pkl.")
+        return False
+    except Exception as e:
+        print(f"⚠️  ONNX conversion failed ({e}), the app will use model.pkl.")
+        return False
+    
+    try:
+        # Record which model.pkl this was converted from so the app can detect stale exports
+        with open(model_path, 'rb') as f:
+            source = onnx_model.metadata_props.add()
+            source.key = 'source_sha256'
+            source.value = hashlib.sha256(f.read()).hexdigest()
+        
+        with open(onnx_path, 'wb') as f:
+            f.write(onnx_model.SerializeToString())
+    except Exception as e:
+        # Do not leave a partial export for the app to pick up
+        if os.path.exists(onnx_path):
+            os.remove(onnx_path)
+        print(f"⚠️  Could not write {onnx_path} ({e}), the app will use model.pkl.")
+        return False
+    
+    print(f"✅ Exported {model_type} to {onnx_path}")
+    return True
+
+def find_model_artifact(artifact_dir):
+    """Find the first model.pkl under a run's artifact directory, shallowest first."""
+    
+    if not os.path.isdir(artifact_dir):
         return None
+    
+    pending = [artifact_dir]
+    while pending:
+        subdirs = []
+        with os.scandir(pending.pop(0)) as entries:
+            for entry in entries:
+                if entry.name == 'model.pkl' and entry.is_file():
+                    return entry.path
+                if entry.is_dir():
+                    subdirs.append(entry.path)
+        pending.extend(sorted(subdirs))
+    return None
 
 def copy_best_model(best_run):
     """Copy the best model to the expected location for the Flask app."""
@@ -102,27 +164,18 @@ def copy_best_model(best_run):
         run_id = best_run['run_id']
         experiment_id = best_run['experiment_id']
         
-        # Look for model artifacts
-        model_paths = [
-            f"mlruns/{experiment_id}/{run_id}/artifacts/model.pkl",
-            f"mlruns/{experiment_id}/{run_id}/artifacts/LogisticRegression_model/model.pkl",
-            f"mlruns/{experiment_id}/{run_id}/artifacts/RandomForest_model/model.pkl",
-            f"mlruns/{experiment_id}/{run_id}/artifacts/LightGBM_model/model.pkl"
-        ]
+        # Look for the model artifact with a single directory walk
+        model_path = find_model_artifact(f"mlruns/{experiment_id}/{run_id}/artifacts")
         
-        model_found = False
-        for model_path in model_paths:
-            if os.path.exists(model_path):
-                print(f"📁 Found model at: {model_path}")
-                shutil.copy2(model_path, 'models/model.pkl')
-                print(f"✅ Copied best model to models/model.pkl")
-                model_found = True
-                break
-        
-        if not model_found:
+        if model_path is None:
             print("❌ Could not find model artifact!")
             return False
         
+        print(f"📁 Found model at: {model_path}")
+        shutil.copy2(model_path, 'models/model.pkl')
+        print(f"✅ Copied best model to models/model.pkl")
+        export_onnx_model('models/model.pkl')
+        
         return True
         
     except Exception as e:
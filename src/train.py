@@ -1,13 +1,15 @@
 # src/train.py
 
 import pandas as pd
+import numpy as np
 import mlflow
 from mlflow import MlflowClient
 import mlflow.sklearn
 from sklearn.linear_model import LogisticRegression
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score
-from sklearn.model_selection import ParameterGrid
+from sklearn.metrics import confusion_matrix
+from sklearn.experimental import enable_halving_search_cv  # enables HalvingGridSearchCV
+from sklearn.model_selection import HalvingGridSearchCV
 import lightgbm as lgb
 import os
 import warnings
@@ -18,22 +20,45 @@ client = MlflowClient(tracking_uri="http://127.0.0.1:5001")
 # Suppress warnings for cleaner output
 warnings.filterwarnings("ignore")
 
+def prepare_cache(path):
+    """Converts the processed CSVs to .npy arrays (float32 features, int32 labels) once."""
+    for name in ["X_train", "X_test", "y_train", "y_test"]:
+        csv_path = os.path.join(path, f"{name}.csv")
+        npy_path = os.path.join(path, f"{name}.npy")
+
+        # Rebuild only if the CSV was regenerated after the cache was written
+        if os.path.exists(npy_path) and os.path.getmtime(npy_path) >= os.path.getmtime(csv_path):
+            continue
+
+        dtype = np.float32 if name.startswith("X") else np.int32
+        values = pd.read_csv(csv_path).to_numpy(dtype)
+        if name.startswith("y"):
+            values = values.ravel()
+        np.save(npy_path, values)
+        print(f"Cached {csv_path} to {npy_path}")
+
 def load_processed_data(path):
-    """Loads the pre-processed training and testing data."""
-    X_train = pd.read_csv(os.path.join(path, "X_train.csv"))
-    X_test = pd.read_csv(os.path.join(path, "X_test.csv"))
-    y_train = pd.read_csv(os.path.join(path, "y_train.csv")).values.ravel()
-    y_test = pd.read_csv(os.path.join(path, "y_test.csv")).values.ravel()
+    """Loads the pre-processed training and testing data as memory-mapped arrays."""
+    prepare_cache(path)
+    X_train = np.load(os.path.join(path, "X_train.npy"), mmap_mode='r')
+    X_test = np.load(os.path.join(path, "X_test.npy"), mmap_mode='r')
+    y_train = np.load(os.path.join(path, "y_train.npy"), mmap_mode='r')
+    y_test = np.load(os.path.join(path, "y_test.npy"), mmap_mode='r')
     return X_train, X_test, y_train, y_test
 
 def evaluate_model(model, X_test, y_test):
     """Evaluates the model and returns performance metrics."""
     predictions = model.predict(X_test)
+
+    # Derive all metrics from a single confusion matrix pass
+    tn, fp, fn, tp = confusion_matrix(y_test, predictions, labels=[0, 1]).ravel()
+    precision = tp / (tp + fp + 1e-12)
+    recall = tp / (tp + fn + 1e-12)
     metrics = {
-        "accuracy": accuracy_score(y_test, predictions),
-        "precision": precisinderion_score(y_test, predictions),
-        "recall": recall_score(y_test, predictions),
-        "f1_score": f1_score(y_test, predictions)
+        "accuracy": float((tp + tn) / (tp + tn + fp + fn)),
+        "precision": float(precision),
+        "recall": float(recall),
+        "f1_score": float(2 * precision * recall / (precision + recall + 1e-12))
     }
     return metrics
 
@@ -45,7 +70,7 @@ def main():
     models = {
         "LogisticRegression": LogisticRegression(),
         "RandomForest": RandomForestClassifier(),
-        "LightGBM": lgb.LGBMClassifier()
+        "LightGBM": lgb.LGBMClassifier(verbosity=-1)
     }
 
     # Define the hyperparameter grids for each model
@@ -75,29 +100,39 @@ def main():
         print(f"--- Training {model_name} ---")
         mlflow.set_experiment(f"{model_name}_Experiment")
         
-        param_grid = ParameterGrid(hyperparameters[model_name])
+        # Successive halving: every candidate starts on a small sample and only the
+        # best third moves on to more data, with the CV fits run in parallel
+        search = HalvingGridSearchCV(
+            model_instance,
+            hyperparameters[model_name],
+            factor=3,
+            scoring="f1",
+            n_jobs=-1,
+            random_state=42
+        )
+        search.fit(X_train, y_train)
         
-        # Loop through each hyperparameter combination
-        for params in param_grid:
-            with mlflow.start_run():
-                print(f"Running with params: {params}")
-                
-                # Log hyperparameters
-                mlflow.log_params(params)
-                
-                # Train model
-                model = model_instance.set_params(**params)
-                model.fit(X_train, y_train)
-                
-                # Evaluate model
-                metrics = evaluate_model(model, X_test, y_test)
-                print(f"Metrics: {metrics}")
-                
-                # Log metrics
-                mlflow.log_metrics(metrics)
-                
-                # Log model
-                mlflow.sklearn.log_model(model, f"{model_name}_model")
+        with mlflow.start_run():
+            print(f"Best params: {search.best_params_}")
+            
+            # Log the winning hyperparameters and the full search results
+            mlflow.log_params(search.best_params_)
+            mlflow.log_metric("cv_f1_score", search.best_score_)
+            mlflow.log_text(pd.DataFrame(search.cv_results_).to_csv(index=False), "cv_results.csv")
+            
+            # Evaluate the refitted best model on the test set
+            metrics = evaluate_model(search.best_estimator_, X_test, y_test)
+            print(f"Metrics: {metrics}")
+            mlflow.log_metrics(metrics)
+            
+            # Log model, skipping signature and requirements inference
+            mlflow.sklearn.log_model(
+                search.best_estimator_,
+                artifact_path=f"{model_name}_model",
+                signature=None,
+                input_example=None,
+                pip_requirements=[]
+            )
 
     print("\nAll experiments complete. Check the MLflow UI.")
 
@@ -0,0 +1,3 @@
+# wsgi.py
+# Entry point for the production WSGI server
+from app import app